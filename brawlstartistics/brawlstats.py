@@ -1,6 +1,6 @@
 import os
-import aiohttp
 import asyncio
+import datetime
 import brawlstats
 import logging
 logger = logging.getLogger("brawlstartistics.brawlstats")
@@ -8,13 +8,30 @@ logger = logging.getLogger("brawlstartistics.brawlstats")
 from .constants import BASE_DIR, ALL_BRAWLERS
 from .database import Client as DbClient
 from .database import Club, Player, UniqueClub, UniquePlayer
+from .transport import TransportConfig, ConnectionStats
 
 
 #Main object
 class Client(brawlstats.Client):
     def __init__(self, **kwargs):
+        #The aiohttp session and connector need a running event loop
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError("Client must be created inside a running event loop "
+                               "(e.g. 'async with Client()' in a coroutine)") from None
+
         self.requestcnt = 0
         echo = kwargs.pop("echo", False)
+        self.transport = kwargs.pop("transport", None)
+        if self.transport is None:
+            self.transport = TransportConfig.from_environment()
+        #Size of the worker pool refreshing club members (shared by all clubs)
+        self.member_workers = kwargs.pop("member_workers", None) or self.transport.limit or 50
+        #Members with a stored player view younger than this many hours are not
+        #fetched again (None or 0: always refresh)
+        member_max_age = kwargs.pop("member_max_age", 12)
+        self.member_max_age = datetime.timedelta(hours=member_max_age) if member_max_age else None
 
         with open(os.path.join(BASE_DIR, "token.txt"), 'r') as file:
             self.token = file.read().strip()
@@ -22,11 +39,18 @@ class Client(brawlstats.Client):
         self.db = DbClient(echo=echo)
         self.logger = logging.getLogger("brawlstartistics.brawlstats.Client")
 
-        httpconnector = aiohttp.TCPConnector(limit=50) #50 requests at a time
-        httpsession = aiohttp.ClientSession(connector=httpconnector)
+        self.connection_stats = ConnectionStats()
+        httpsession = self.transport.session(self.connection_stats)
+        if self.transport.base_url is not None:
+            kwargs.setdefault("base_url", self.transport.base_url)
+        self.logger.info(f"Using {self.transport!r}")
 
-        super().__init__(self.token, session=httpsession, is_async=True,
-                         prevent_ratelimit=True, **kwargs)
+        #brawlstats passes timeout and headers with every request, which
+        #overrides the defaults of the session
+        super().__init__(self.token, session=httpsession,
+                         timeout=self.transport.client_timeout(),
+                         is_async=True, prevent_ratelimit=True, **kwargs)
+        self.headers["Accept-Encoding"] = self.transport.accept_encoding()
 
     def __enter__(self):
         return self
@@ -38,10 +62,12 @@ class Client(brawlstats.Client):
         return self.close()
 
     def close(self):
+        self.logger.info(f"HTTP transport: {self.connection_stats}")
         self.db.close()
         return super().close()
 
     async def aclose(self):
+        self.logger.info(f"HTTP transport: {self.connection_stats}")
         self.db.close()
         return await super().close()
 
@@ -82,6 +108,79 @@ class Client(brawlstats.Client):
         results = await asyncio.gather(*(self.get_club(tag) for tag in tags))
         return results
 
+    async def refresh_members(self, clubs, known_players=None, on_club_done=None):
+        """Fetch the full player information for all members of clubs
+
+        A fixed pool of self.member_workers coroutines, shared by all clubs,
+        works through the members, so the concurrency stays flat no matter how
+        many clubs are pending. Only stale members are requested: members whose
+        tag is in known_players (tag -> brawlstats player, e.g. fetched earlier
+        in the same crawl) are refreshed from there, and members with a stored
+        player view younger than self.member_max_age are removed from the club,
+        so that no roster-only views get stored for them.
+        on_club_done(club) is called as soon as all members of a club are done.
+        """
+        if known_players is None:
+            known_players = {}
+        if self.member_max_age is not None:
+            tags = [ member.tag for club in clubs for member in club.members
+                     if member.tag not in known_players ]
+            last_views = self.db.get_last_player_times(tags)
+            fresh_after = datetime.datetime.utcnow() - self.member_max_age
+            n_fresh = 0
+            for club in clubs:
+                members = [ member for member in club.members
+                            if member.tag in known_players
+                            or last_views.get(member.tag, fresh_after) <= fresh_after ]
+                n_fresh += len(club.members) - len(members)
+                club.members = members
+            self.logger.info(f"Skipping {n_fresh} members with a player view "
+                             f"younger than {self.member_max_age}.")
+
+        pending = { id(club) : len(club.members) for club in clubs }
+        queue = asyncio.Queue(maxsize=2*self.member_workers)
+
+        def member_done(club):
+            pending[id(club)] -= 1
+            if pending[id(club)] == 0 and on_club_done is not None:
+                on_club_done(club)
+
+        async def produce():
+            for club in clubs:
+                if not club.members and on_club_done is not None:
+                    on_club_done(club)
+                for member in club.members:
+                    player = known_players.get(member.tag)
+                    if player is not None:
+                        member.refresh(player)
+                        member_done(club)
+                    else:
+                        await queue.put((club, member))
+            for _ in range(self.member_workers):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                club, member = item
+                player = await self.get_player(member.tag)
+                if player is not None:
+                    member.refresh(player)
+                member_done(club)
+
+        tasks = [ asyncio.ensure_future(produce()) ]
+        tasks += [ asyncio.ensure_future(work()) for _ in range(self.member_workers) ]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        return clubs
+
     async def crawl(self, player_limit=100):
         #1. Read random tags from database
         unique_players = self.db.get_random_db_entries(Player, player_limit)
@@ -93,22 +192,14 @@ class Client(brawlstats.Client):
         players = [ player for player in players if player is not None ]
         self.logger.info(f"Successfully updated information for {len(players)} players.")
 
-        #3. Update information from their clubs
-        club_tags = [ p.club.tag for p in players if p.club is not None ]
+        #3. Update information from their clubs (each club only once)
+        club_tags = list(dict.fromkeys(p.club.tag for p in players if p.club is not None))
         self.logger.info(f"Updating information for {len(club_tags)} clubs (of the players)...")
         clubs = await self.get_clubs(club_tags)
         clubs = [ club for club in clubs if club is not None ]
         self.logger.info(f"Successfully updated information for {len(clubs)} clubs.")
 
-        #4. Building database club objects out of them (and updating member information)
-        db_clubs = []
-        self.logger.info(f"Processing clubs to update their members...")
-        for i, club in enumerate(clubs):
-            self.logger.info(f"Processing club {i+1} of {len(clubs)} (#{club.tag}) with {club.membersCount} members...")
-            db_club = await Club.from_brawlstats(club, self)
-            db_clubs.append(db_club)
-
-        #5. Set balanceChangeId
+        #4. Get balanceChangeId
         balance_change_id = self.db.get_last_balance_change()
         if balance_change_id is not None:
             balance_change_id = balance_change_id.id
@@ -120,17 +211,36 @@ class Client(brawlstats.Client):
         self.logger.info("Setting balance change ids to {} "
                        "and brawler change ids to {!r}..."
                        "".format(balance_change_id, brawler_change_ids))
-        for club in db_clubs:
+
+        #5. Build database club objects, update their members and store every
+        #   club (with its players and brawlers) as soon as it is complete.
+        #   Storing is synchronous (it briefly blocks the member fetches) and
+        #   per club, so an aborted crawl leaves the finished clubs persisted.
+        db_clubs = [ Club(**Club.brawlstats_to_dict(club)) for club in clubs ]
+        known_players = { player.tag : player for player in players }
+        stored_clubs = []
+
+        def store_club(club):
             club.balanceChangeId = balance_change_id
             for member in club.members:
                 member.balanceChangeId = balance_change_id
                 for brawler in member.brawlers:
                     brawler.brawlerChangeId = brawler_change_ids[brawler.name]
-
-
-        self.logger.info(f"Storing crawled clubs, players and brawlers in database...")
-        self.db.add_clubs(db_clubs)
-        self.db.commit()
+            self.logger.info(f"Storing club {len(stored_clubs)+1} of {len(db_clubs)} "
+                             f"(#{club.tag}) with {len(club.members)} members...")
+            try:
+                self.db.add_clubs([club])
+                self.db.commit()
+            except Exception:
+                self.db.dbsession.rollback()
+                self.logger.exception(f"Could not store club #{club.tag}, skipping it")
+                return
+            stored_clubs.append(club)
+
+        n_members = sum(len(club.members) for club in db_clubs)
+        self.logger.info(f"Updating {n_members} members of {len(db_clubs)} clubs "
+                         f"with {self.member_workers} workers...")
+        await self.refresh_members(db_clubs, known_players, on_club_done=store_club)
 
         n_players = self.db.get_number_db_entries(UniquePlayer)
         n_clubs = self.db.get_number_db_entries(UniqueClub)
@@ -138,4 +248,4 @@ class Client(brawlstats.Client):
         self.logger.info(f"The database now contains {n_clubs} unique clubs and "
                        f"{n_players} players.")
 
-        return db_clubs
+        return stored_clubs
@@ -8,7 +8,9 @@ logger = logging.getLogger("brawlstartistics.database")
 
 #SQLALCHEMY
 from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
-from sqlalchemy import ForeignKey, create_engine, func
+from sqlalchemy import ForeignKey, create_engine, event, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from sqlalchemy.exc import IntegrityError
@@ -28,6 +30,21 @@ def valid_tag(tag):
 
     return True
 
+#Engine tuning for the embedded (single-node) SQLite profile
+SQLITE_PRAGMAS = {
+    "journal_mode" : "WAL",
+    "synchronous" : "NORMAL",
+    "mmap_size" : 256*1024*1024,  #bytes of memory-mapped I/O
+    "cache_size" : -64*1024,      #negative = KiB, i.e. 64 MiB page cache
+    "temp_store" : "MEMORY",
+}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for key, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {key}={value}")
+    cursor.close()
+
 def convert_time_string(self, timestring):
     return datetime.datetime.strptime(timestring, '%d.%m.%y %H:%M:%S')
 
@@ -111,7 +128,7 @@ class Player(Base):
 
     id = Column(Integer, primary_key=True)
     clubId = Column(Integer, ForeignKey("clubs.id"))
-    tag = Column(String(MAX_TAG_LENGTH), ForeignKey("player_list.tag"), nullable=False)
+    tag = Column(String(MAX_TAG_LENGTH), ForeignKey("player_list.tag"), nullable=False, index=True)
     datetime = Column(DateTime)
     name = Column(String(MAX_NAME_LENGTH), nullable=False)
     nameColorCode = Column(Text)
@@ -167,7 +184,13 @@ class Player(Base):
 
         player = await client.get_player(self.tag)
         if player is not None:
-            self.__init__(**Player.brawlstats_to_dict(player))
+            self.refresh(player)
+        return self
+
+    def refresh(self, bs_player):
+        """Overwrite (roster) information with an already fetched player"""
+        for k, v in Player.brawlstats_to_dict(bs_player).items():
+            setattr(self, k, v)
         return self
 
 
@@ -206,6 +229,17 @@ class Club(Base):
 
     @classmethod
     async def from_brawlstats(cls, bs_club, client=None):
+        club = cls(**cls.brawlstats_to_dict(bs_club))
+        if hasattr(client, "refresh_members"):
+            await client.refresh_members([club])
+        elif client is not None:
+            #Any other brawlstats client: update every member on its own
+            await asyncio.gather(*(m.update(client) for m in club.members))
+        return club
+
+    @staticmethod
+    def brawlstats_to_dict(bs_club):
+        """Members only carry the roster information (see Player.refresh)"""
         try:
             date = dateutil.parser.parse(bs_club.resp.headers["Date"])
         except AttributeError:
@@ -221,13 +255,11 @@ class Club(Base):
                     member = dict(member)
                     del member["id"]
                     members.append(Player(**member))
-                if client is not None:
-                    members = await asyncio.gather(*(m.update(client) for m in members))
                 d["members"] = members
             elif k != "id":
                 d[k] = v
 
-        return cls(**d)
+        return d
 
     def __repr__(self):
         return "{}({!r})".format(self.__class__.__name__, self.__dict__)
@@ -294,10 +326,17 @@ BrawlerChange.brawlers = relationship("Brawler", back_populates="brawlerChange")
 class Client():
     def __init__(self, **kwargs):
         self.logger = logging.getLogger('brawlstartistics.database.Client')
-        with open(os.path.join(BASE_DIR, "db.txt"), 'r') as file:
-            db = file.read().strip()
+        db = kwargs.pop("url", None)
+        if db is None:
+            with open(os.path.join(BASE_DIR, "db.txt"), 'r') as file:
+                db = file.read().strip()
 
         self.dbengine = create_engine(db, echo=kwargs.pop("echo", False))
+        self.dialect = self.dbengine.dialect.name
+        if self.dialect == "sqlite":
+            #Embedded store: tune the engine and create the schema if needed
+            event.listen(self.dbengine, "connect", set_sqlite_pragmas)
+            metadata.create_all(self.dbengine)
         dbsession = sessionmaker(bind=self.dbengine)
         self.dbsession = dbsession()
 
@@ -315,7 +354,21 @@ class Client():
 
     def get_random_db_entries(self, dbmodel, limit=100):
         """Return random entries from database"""
-        return self.query(dbmodel).order_by(func.rand()).limit(limit).all()
+        rand = func.rand() if self.dialect == "mysql" else func.random()
+        return self.query(dbmodel).order_by(rand).limit(limit).all()
+
+    def get_last_player_times(self, tags, chunksize=500):
+        """Return tag -> datetime of the latest stored player view"""
+        tags = list(set(tags))
+        times = {}
+        for i in range(0, len(tags), chunksize):
+            rows = (self.query(Player.tag, func.max(Player.datetime))
+                        .filter(Player.tag.in_(tags[i:i+chunksize]))
+                        .group_by(Player.tag).all())
+            for tag, time in rows:
+                if time is not None:
+                    times[tag] = time.replace(tzinfo=None)
+        return times
 
     def get_number_db_entries(self, dbmodel):
         return self.query(dbmodel).count()
@@ -347,25 +400,44 @@ class Client():
             self.dbsession.rollback()
             return False
 
+    def insert_if_not_exists(self, dbmodel, tags, chunksize=500):
+        """Upsert unique tags, return how many of them were new"""
+        if self.dialect not in ["mysql", "sqlite"]:
+            return sum(self.add_if_not_exists(dbmodel(tag=tag, added=datetime.datetime.utcnow()))
+                       for tag in tags)
+
+        tags = list(dict.fromkeys(tags))
+        for tag in tags:
+            if not valid_tag(tag):
+                raise ValueError("{} is no valid tag!".format(tag))
+
+        #Count before inserting, the affected rows of an upsert differ by dialect
+        n_existing = 0
+        for i in range(0, len(tags), chunksize):
+            n_existing += (self.query(dbmodel.tag)
+                               .filter(dbmodel.tag.in_(tags[i:i+chunksize])).count())
+
+        if tags:
+            if self.dialect == "mysql":
+                stmt = mysql_insert(dbmodel.__table__)
+                stmt = stmt.on_duplicate_key_update(tag=stmt.inserted.tag)
+            else:
+                stmt = sqlite_insert(dbmodel.__table__).on_conflict_do_nothing()
+            now = datetime.datetime.utcnow()
+            self.dbsession.execute(stmt, [ { "tag" : tag, "added" : now } for tag in tags ])
+        return len(tags) - n_existing
+
     def add_all(self, dbobjects):
         self.dbsession.add_all(dbobjects)
 
     def add_clubs(self, dbclubs):
         #Build unique clubs and players out of it
-        n_clubs = 0
-        new_clubs = 0
-        n_players = 0
-        new_players = 0
-        for club in dbclubs:
-            n_clubs += 1
-            if self.add_if_not_exists(
-                    UniqueClub(tag=club.tag, added=datetime.datetime.utcnow())):
-                new_clubs += 1
-            for player in club.members:
-                n_players += 1
-                if self.add_if_not_exists(
-                        UniquePlayer(tag=player.tag, added=datetime.datetime.utcnow())):
-                    new_players += 1
+        club_tags = [ club.tag for club in dbclubs ]
+        player_tags = [ player.tag for club in dbclubs for player in club.members ]
+        n_clubs = len(club_tags)
+        n_players = len(player_tags)
+        new_clubs = self.insert_if_not_exists(UniqueClub, club_tags)
+        new_players = self.insert_if_not_exists(UniquePlayer, player_tags)
 
         self.add_all(dbclubs)
         self.logger.info(f"Added ({new_clubs}) {n_clubs} (new) clubs.")
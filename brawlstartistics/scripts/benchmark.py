@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Compare the crawl persistence throughput of database backends.
+
+Usage:
+    bs_benchmark N_CLUBS URL [URL ...]
+
+Stores N_CLUBS synthetic clubs (with members and brawlers) the same way a
+crawl does (Client.add_clubs + commit per club) in every given database and
+reports clubs, players and brawlers per second. Use scratch databases only,
+e.g. sqlite:////tmp/bs_bench.db and a separate MySQL schema, the benchmark
+writes synthetic rows into them.
+"""
+import sys
+import time
+import random
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+from ..constants import TAG_CHARS, ALL_BRAWLERS
+from ..database import Client, Club, Player, Brawler, metadata
+
+MEMBERS_PER_CLUB = 100
+SEED = 42  #every database gets the same synthetic clubs
+
+def random_tag():
+    return "".join(random.choice(TAG_CHARS) for _ in range(9))
+
+def synthetic_club(date):
+    members = []
+    for i in range(MEMBERS_PER_CLUB):
+        brawlers = [ Brawler(name=name, datetime=date, hasSkin=False,
+                             trophies=random.randint(0, 500), highestTrophies=500,
+                             power=random.randint(1, 10), rank=random.randint(1, 20))
+                     for name in random.sample(ALL_BRAWLERS, 10) ]
+        members.append(Player(tag=random_tag(), name=f"Player {i}", datetime=date,
+                              trophies=random.randint(0, 20000), role="member",
+                              brawlers=brawlers))
+    return Club(tag=random_tag(), name="Benchmark club", datetime=date,
+                membersCount=len(members), members=members)
+
+def benchmark(url, n_clubs):
+    with Client(url=url) as client:
+        metadata.create_all(client.dbengine)
+        random.seed(SEED)
+        date = datetime.datetime(2020, 1, 1)
+        clubs = [ synthetic_club(date) for _ in range(n_clubs) ]
+
+        start = time.perf_counter()
+        for club in clubs:
+            client.add_clubs([club])
+            client.commit()
+        elapsed = time.perf_counter() - start
+
+    n_players = n_clubs * MEMBERS_PER_CLUB
+    n_brawlers = n_players * 10
+    logger.info(f"{client.dialect}: stored {n_clubs} clubs in {elapsed:.2f}s - "
+                f"{n_clubs/elapsed:.1f} clubs/s, {n_players/elapsed:.0f} players/s, "
+                f"{n_brawlers/elapsed:.0f} brawlers/s")
+    return elapsed
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    try:
+        n_clubs = int(sys.argv[1])
+    except ValueError:
+        n_clubs = 0
+    if n_clubs < 1:
+        logger.error(f"N_CLUBS must be a number of at least 1, not {sys.argv[1]!r}!")
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    logging.getLogger("brawlstartistics.database").setLevel(logging.WARNING)
+    for url in sys.argv[2:]:
+        benchmark(url, n_clubs)
+
+
+if __name__ == "__main__":
+    main()
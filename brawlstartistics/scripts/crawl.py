@@ -5,17 +5,22 @@ import sys
 import logging
 logger = logging.getLogger(__name__)
 
-async def crawl(limit=100):
-    async with Client() as client:
+async def crawl(limit=100, member_max_age=12):
+    async with Client(member_max_age=member_max_age) as client:
         await client.crawl(limit)
 
 def main():
     limit = 100
     if len(sys.argv) > 1:
         limit = int(sys.argv[1])
-    logger.info(f"Crawling limit is set to {limit}!")
+    #Hours a stored player view counts as fresh, 0 refreshes every member
+    member_max_age = 12
+    if len(sys.argv) > 2:
+        member_max_age = float(sys.argv[2])
+    logger.info(f"Crawling limit is set to {limit}, "
+                f"member max age to {member_max_age} hours!")
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(crawl(limit))
+    loop.run_until_complete(crawl(limit, member_max_age))
 
 
 if __name__ == "__main__":
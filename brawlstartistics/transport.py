@@ -0,0 +1,156 @@
+import os
+import aiohttp
+import logging
+logger = logging.getLogger("brawlstartistics.transport")
+
+from .constants import BASE_DIR
+
+
+def str_to_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ["1", "true", "yes", "on"]:
+        return True
+    if value in ["0", "false", "no", "off"]:
+        return False
+    raise ValueError("{} is no valid boolean!".format(value))
+
+def str_to_optional(value):
+    if value is None or str(value).strip().lower() in ["", "none"]:
+        return None
+    return str(value).strip()
+
+
+# ====================================================
+# ===== HTTP transport settings ======================
+# ====================================================
+class TransportConfig():
+    """Settings of the HTTP layer used to talk to the Brawl Stars API
+
+    Values are taken (in increasing priority) from the defaults below,
+    the file BASE_DIR/transport.txt (one "key = value" per line, "#" starts
+    a comment), environment variables BRAWLSTARTISTICS_<KEY> and keyword
+    arguments.
+    """
+    FILENAME = "transport.txt"
+    ENV_PREFIX = "BRAWLSTARTISTICS_"
+
+    #key : (default, converter)
+    OPTIONS = {
+        "base_url" : (None, str_to_optional),
+        "limit" : (50, int),                  #connections at a time
+        "limit_per_host" : (0, int),          #0 = no extra per-host limit
+        "ttl_dns_cache" : (300, int),         #seconds, 0 disables the cache
+        "keepalive_timeout" : (30.0, float),  #seconds an idle connection is kept
+        "timeout" : (30.0, float),            #total seconds per request
+        "connect_timeout" : (10.0, float),
+        "compression" : (True, str_to_bool),  #ask for gzip/deflate responses
+    }
+
+    def __init__(self, **kwargs):
+        for key, (default, convert) in self.OPTIONS.items():
+            value = kwargs.pop(key, default)
+            setattr(self, key, value if value is None else convert(value))
+        if kwargs:
+            raise ValueError("Unknown transport options: {}".format(", ".join(kwargs)))
+
+    @classmethod
+    def from_environment(cls, path=None, **kwargs):
+        """Read settings from the transport file and the environment"""
+        if path is None:
+            path = os.path.join(BASE_DIR, cls.FILENAME)
+
+        d = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    line = line.split("#", 1)[0].strip()
+                    if not line:
+                        continue
+                    key, sep, value = line.partition("=")
+                    if not sep:
+                        raise ValueError("Invalid line in {}: {!r}".format(path, line))
+                    d[key.strip()] = value.strip()
+
+        for key in cls.OPTIONS:
+            env = os.environ.get(cls.ENV_PREFIX + key.upper())
+            if env is not None:
+                d[key] = env
+
+        d.update(kwargs)
+        return cls(**d)
+
+    def connector(self):
+        return aiohttp.TCPConnector(limit=self.limit,
+                                    limit_per_host=self.limit_per_host,
+                                    use_dns_cache=self.ttl_dns_cache > 0,
+                                    ttl_dns_cache=self.ttl_dns_cache or None,
+                                    keepalive_timeout=self.keepalive_timeout)
+
+    def accept_encoding(self):
+        """Accept-Encoding request header, "identity" turns compression off"""
+        return "gzip, deflate" if self.compression else "identity"
+
+    def client_timeout(self):
+        return aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+
+    def session(self, stats=None):
+        """Build an aiohttp session, counting connections in stats (if given)"""
+        trace_configs = []
+        if stats is not None:
+            trace_configs.append(stats.trace_config())
+
+        return aiohttp.ClientSession(connector=self.connector(),
+                                     timeout=self.client_timeout(),
+                                     trace_configs=trace_configs)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.__dict__)
+
+
+class ConnectionStats():
+    """Count how often pooled connections are reused instead of opened"""
+    def __init__(self):
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+        return trace_config
+
+    async def _on_request_start(self, session, context, params):
+        self.requests += 1
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.created += 1
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.reused += 1
+
+    async def _on_dns_cache_hit(self, session, context, params):
+        self.dns_cache_hits += 1
+
+    async def _on_dns_cache_miss(self, session, context, params):
+        self.dns_cache_misses += 1
+
+    @property
+    def reuse_ratio(self):
+        connections = self.created + self.reused
+        return self.reused / connections if connections else 0.0
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.created} connections opened, "
+                f"{self.reused} reused ({self.reuse_ratio:.1%}), "
+                f"DNS cache {self.dns_cache_hits} hits / {self.dns_cache_misses} misses")
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.__dict__)
@@ -15,7 +15,8 @@ setup(
     entry_points={
         "console_scripts" : [
             "bs_crawl = brawlstartistics.scripts.crawl:main",
-            "bs_telegram_bot = brawlstartistics.scripts.telegram_bot:main"
+            "bs_telegram_bot = brawlstartistics.scripts.telegram_bot:main",
+            "bs_benchmark = brawlstartistics.scripts.benchmark:main"
         ]
     }
 )